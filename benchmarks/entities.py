@@ -0,0 +1,57 @@
+"""
+Benchmarks the extraction of entity texts from long, emoji heavy messages.
+
+Run with: PYTHONPATH=src python benchmarks/entities.py
+"""
+from typing import List
+import timeit
+
+from py_gram import objects
+
+
+def create_message(repetitions: int) -> objects.Message:
+    chunk = '\U0001F600 hey @john check https://example.com/page \U0001F680 #news /help '
+    chunk_length = len(chunk.encode('utf-16-le')) // 2
+    entities = []
+    for i in range(repetitions):
+        offset = i * chunk_length
+        entities.extend([
+            objects.MessageEntity(objects.MessageEntityType.MENTION, offset + 7, 5),
+            objects.MessageEntity(objects.MessageEntityType.URL, offset + 19, 24),
+            objects.MessageEntity(objects.MessageEntityType.HASHTAG, offset + 47, 5),
+            objects.MessageEntity(objects.MessageEntityType.BOT_COMMAND, offset + 53, 5),
+        ])
+    user = objects.User(id=1, is_bot=False, first_name='John')
+    chat = objects.Chat(id=1965, chat_type=objects.ChatType.PRIVATE)
+    return objects.Message(message_id=1, from_user=user, date=0, chat=chat, text=chunk * repetitions,
+                           entities=entities)
+
+
+def extract_per_entity(message: objects.Message) -> List[str]:
+    # converts the whole text for every entity
+    return [message.text.encode('utf-16-le')[entity.offset * 2: (entity.offset + entity.length) * 2]
+            .decode('utf-16-le')
+            for entity in message.entities]
+
+
+def extract_once(message: objects.Message) -> List[str]:
+    message._entity_texts = None
+    return message.get_entity_texts(objects.MessageEntityType.URL)
+
+
+def main() -> None:
+    for repetitions in (1, 10, 60):
+        message = create_message(repetitions)
+        assert set(extract_per_entity(message)) >= set(extract_once(message))
+        number = 1_000
+        per_entity = timeit.timeit(lambda: extract_per_entity(message), number=number)
+        once = timeit.timeit(lambda: extract_once(message), number=number)
+        cached = timeit.timeit(lambda: message.get_entity_texts(objects.MessageEntityType.URL), number=number)
+        print(f'{len(message.text):>5} chars, {len(message.entities):>3} entities: '
+              f'per entity {per_entity / number * 1e6:8.2f}us, '
+              f'single pass {once / number * 1e6:8.2f}us, '
+              f'cached {cached / number * 1e6:8.2f}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures the cold start of a fresh interpreter: the time to import py_gram and TelegramClient, and the latency of the
+first and second requests against a local server. Prints the timings (in seconds) and the heavy modules imported by
+`import py_gram` as JSON.
+
+Run with: PYTHONPATH=src python benchmarks/startup.py
+"""
+import sys
+import time
+
+started = time.perf_counter()
+import py_gram  # noqa: E402
+imported_package = time.perf_counter()
+from py_gram import TelegramClient  # noqa: E402
+imported_client = time.perf_counter()
+loaded_by_package_import = sorted(module for module in ('httpx', 'sqlite3', 'py_gram.state', 'py_gram.profiling',
+                                                       'py_gram.scheduling') if module in sys.modules)
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # noqa: E402
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import threading  # noqa: E402
+
+
+class GetMeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'SuperBot'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def measure_requests(client: TelegramClient):
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        await client.get_me()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    os.environ['NO_PROXY'] = '127.0.0.1'
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GetMeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    class LocalTelegramClient(TelegramClient):
+        BASE_URL_FORMAT = f'http://127.0.0.1:{server.server_address[1]}/bot{{bot_token}}'
+
+    first_request, second_request = asyncio.run(measure_requests(LocalTelegramClient('test-token')))
+    server.shutdown()
+    print(json.dumps({
+        'import_package': imported_package - started,
+        'import_client': imported_client - imported_package,
+        'first_request': first_request,
+        'second_request': second_request,
+        'loaded_by_package_import': loaded_by_package_import,
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,55 @@
-from py_gram import objects
-from py_gram.client import ClientError
-from py_gram.client import TelegramClient
+from typing import TYPE_CHECKING
+import importlib
+
+# The public names are imported on first access, so `import py_gram` does not pay for the dependencies of the parts
+# that are not used.
+_LAZY_ATTRIBUTES = {
+    'objects': 'py_gram',
+    'ClientError': 'py_gram.client',
+    'TelegramClient': 'py_gram.client',
+    'ExecutionPolicy': 'py_gram.executors',
+    'CallbackSink': 'py_gram.profiling',
+    'FileSink': 'py_gram.profiling',
+    'LoggingSink': 'py_gram.profiling',
+    'Profiler': 'py_gram.profiling',
+    'PriorityScheduler': 'py_gram.scheduling',
+    'SheddingPolicy': 'py_gram.scheduling',
+    'UpdatePriority': 'py_gram.scheduling',
+    'StateNotLoadedError': 'py_gram.state',
+    'StateStore': 'py_gram.state',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+if TYPE_CHECKING:
+    from py_gram import objects
+    from py_gram.client import ClientError
+    from py_gram.client import TelegramClient
+    from py_gram.executors import ExecutionPolicy
+    from py_gram.profiling import CallbackSink
+    from py_gram.profiling import FileSink
+    from py_gram.profiling import LoggingSink
+    from py_gram.profiling import Profiler
+    from py_gram.scheduling import PriorityScheduler
+    from py_gram.scheduling import SheddingPolicy
+    from py_gram.scheduling import UpdatePriority
+    from py_gram.state import StateNotLoadedError
+    from py_gram.state import StateStore
+
+
+def __getattr__(name: str):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+
+    if module_name == __name__:
+        value = importlib.import_module(f'{__name__}.{name}')
+    else:
+        value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
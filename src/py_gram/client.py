@@ -1,12 +1,20 @@
-from typing import Dict, Union, List, Callable, Awaitable, DefaultDict
+from typing import Dict, Union, List, Callable, Awaitable, DefaultDict, Optional, AsyncIterator, Set, TYPE_CHECKING
 import asyncio
 import collections
-import json
-import signal
-
-import httpx
+import collections.abc
+import functools
 
 from py_gram import objects
+from py_gram.executors import ExecutionPolicy, HandlerExecutor, TrackingClient
+
+# httpx, json and signal are imported where they are first needed, to keep `import py_gram` cheap for short-lived
+# processes. The optional components are only needed by callers that pass them in.
+if TYPE_CHECKING:
+    import ssl
+
+    from py_gram.profiling import Profiler
+    from py_gram.scheduling import PriorityScheduler
+    from py_gram.state import StateStore
 
 
 # https://core.telegram.org/bots/api
@@ -19,18 +27,31 @@ class ClientError(Exception):
 
 class TelegramClient:
     BASE_URL_FORMAT = 'https://api.telegram.org/bot{bot_token}'
-
-    def __init__(self, bot_token: str):
+    LONG_POLLING_TIMEOUT = 30
+    # extra time given to the HTTP request on top of the long polling timeout
+    LONG_POLLING_GRACE = 5
+    # shared by all the requests, creating it loads the CA certificates (honouring SSL_CERT_FILE/SSL_CERT_DIR), so
+    # changes to them are only picked up by a new process
+    _ssl_context: Optional['ssl.SSLContext'] = None
+
+    def __init__(self, bot_token: str, state_store: 'StateStore' = None, scheduler: 'PriorityScheduler' = None,
+                 profiler: 'Profiler' = None):
         self._bot_token = bot_token
+        self._state_store = state_store
+        self._scheduler = scheduler
+        self._profiler = profiler
         self._message_handlers: List[Callable[['TelegramClient', objects.Message], Awaitable[None]]] = []
         self._command_handlers: DefaultDict[
             str, List[Callable[['TelegramClient', str, objects.Message], Awaitable[None]]]] = collections.defaultdict(
             list)
         self._callback_query_handlers: List[Callable[['TelegramClient', objects.CallbackQuery], Awaitable[None]]] = []
-        self._queue = asyncio.Queue()
+        self._executors: Dict[ExecutionPolicy, HandlerExecutor] = {}
+        self._executor_handlers: Set[Callable[..., Awaitable[None]]] = set()
         self._listening = False
 
     def _handle_signal(self, sig: int) -> None:
+        import signal
+
         loop = asyncio.get_running_loop()
         pending = asyncio.all_tasks(loop=loop)
         for task in pending:
@@ -45,23 +66,94 @@ class TelegramClient:
         asyncio.run(self.start_updates_worker())
 
     async def start_updates_worker(self):
+        import signal
+
         loop = asyncio.get_running_loop()
         for sig in (signal.SIGTERM, signal.SIGINT):
             loop.add_signal_handler(sig, self._handle_signal, sig)
 
+        if self._state_store is not None:
+            await self._state_store.start()
         try:
-            update = None
-            self._queue.put_nowait(None)
-            while True:
-                update_id = await self._queue.get()
-                updates = await self.get_updates(update_id)
-                for update in updates:
+            if self._scheduler is None:
+                async for update in self.updates(timeout=0):
                     await self._receive_update(update)
-                update_id = update.update_id + 1 if update else None
-                self._queue.task_done()
-                self._queue.put_nowait(update_id)
+            else:
+                await self._dispatch_scheduled_updates()
         except asyncio.CancelledError:
             pass
+        finally:
+            for executor in self._executors.values():
+                await executor.join()
+                executor.shutdown()
+            if self._state_store is not None:
+                await self._state_store.stop()
+
+    async def _dispatch_scheduled_updates(self) -> None:
+        """
+        Polls for updates in a separate task, so the scheduler can reorder and shed the updates that pile up while
+        handlers are running.
+
+        Polling confirms the updates received so far, so it waits while the scheduler is full, and the pending updates
+        are dispatched before returning.
+        """
+        async def poll() -> None:
+            async for polled_update in self.updates(timeout=0):
+                await self._scheduler.put(polled_update)
+                await self._scheduler.wait_for_room()
+
+        loop = asyncio.get_running_loop()
+        poller = loop.create_task(poll())
+        getter = None
+        try:
+            while not poller.done():
+                getter = loop.create_task(self._scheduler.get())
+                await asyncio.wait({getter, poller}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    update, getter = getter.result(), None
+                    await self._receive_update(update)
+        finally:
+            poller.cancel()
+            if getter is not None:
+                getter.cancel()
+                # cancelled while the update it got was not dispatched yet
+                if getter.done() and not getter.cancelled():
+                    await self._receive_update(getter.result())
+            update = self._scheduler.get_nowait()
+            while update is not None:
+                await self._receive_update(update)
+                update = self._scheduler.get_nowait()
+        # polling failed
+        poller.result()
+
+    @property
+    def state_store(self) -> Optional['StateStore']:
+        return self._state_store
+
+    def get_state(self, chat_id: int, user_id: int) -> Dict:
+        """
+        Returns the conversation state of the given chat and user.
+
+        The state of the chat and user of the update being handled is loaded before the handlers are called, so this
+        is served from memory. The state of other chats and users, or one evicted before a pooled handler got to run,
+        has to be loaded with load_state first. Pass the (possibly mutated) state to set_state to persist it.
+        """
+        if self._state_store is None:
+            raise ClientError('No state store was configured for this client')
+        return self._state_store.get(chat_id, user_id)
+
+    async def load_state(self, chat_id: int, user_id: int) -> Dict:
+        """
+        Returns the conversation state of the given chat and user, reading it from the database if necessary.
+        """
+        if self._state_store is None:
+            raise ClientError('No state store was configured for this client')
+        return await self._state_store.load(chat_id, user_id)
+
+    def set_state(self, chat_id: int, user_id: int, state: Dict) -> None:
+        if self._state_store is None:
+            raise ClientError('No state store was configured for this client')
+        self._state_store.set(chat_id, user_id, state)
 
     @property
     def _base_url(self) -> str:
@@ -81,6 +173,8 @@ class TelegramClient:
             'text': text,
         }
         if keyboard_markup:
+            import json
+
             data['reply_markup'] = json.dumps(keyboard_markup.to_dict())
         result = await self._execute_post(url, data)
         self._raise_for_error(result)
@@ -101,24 +195,57 @@ class TelegramClient:
         if reply_to_message_id is not None:
             data['reply_to_message_id'] = reply_to_message_id
         if keyboard_markup:
+            import json
+
             data['reply_markup'] = json.dumps(keyboard_markup.to_dict())
         result = await self._execute_post(url, data)
         self._raise_for_error(result)
         return objects.Message.from_dict(result['result'])
 
-    async def get_updates(self, update_id: int = None) -> List[objects.Update]:
+    async def get_updates(self, update_id: int = None, timeout: int = None,
+                          limit: int = None) -> List[objects.Update]:
+        results = await self._get_raw_updates(update_id, timeout=timeout, limit=limit)
+        return [objects.Update.from_dict(result) for result in results]
+
+    async def updates(self, offset: int = None, timeout: int = LONG_POLLING_TIMEOUT, batch_size: int = None,
+                      raw: bool = False) -> AsyncIterator[Union[objects.Update, Dict, List]]:
+        """
+        Yields updates as they arrive, long polling for `timeout` seconds at a time (0 for short polling).
+
+        Updates are parsed unless `raw` is set, in which case the dicts returned by the API are yielded as is. With a
+        `batch_size`, up to that many updates are fetched at a time and yielded together as a list.
+
+        The offset of an update is committed once the consumer asks for the next one (or the next batch), so updates
+        are delivered at least once: those not consumed when the iteration stops are fetched again next time.
+        """
+        while True:
+            results = await self._get_raw_updates(offset, timeout=timeout, limit=batch_size)
+            if not results:
+                continue
+            last_update_id = results[-1]['update_id']
+            items = results if raw else [objects.Update.from_dict(result) for result in results]
+            if batch_size:
+                yield items
+                offset = last_update_id + 1
+            else:
+                for result, item in zip(results, items):
+                    yield item
+                    offset = result['update_id'] + 1
+
+    async def _get_raw_updates(self, update_id: int = None, timeout: int = None, limit: int = None) -> List[Dict]:
         params = {}
         if update_id is not None:
             params['offset'] = update_id
+        if timeout:
+            params['timeout'] = timeout
+        if limit is not None:
+            params['limit'] = limit
 
         url = f'{self._base_url}/getUpdates'
-        data = await self._execute_get(url, params=params)
-        updates = []
+        request_timeout = timeout + self.LONG_POLLING_GRACE if timeout else None
+        data = await self._execute_get(url, params=params, timeout=request_timeout)
         self._raise_for_error(data)
-        for result in data['result']:
-            update = objects.Update.from_dict(result)
-            updates.append(update)
-        return updates
+        return data['result']
 
     async def answer_callback_query(self, callback_query_id: str, text: str = None, show_alert: bool = None,
                                     url: str = None, cache_time: int = None) -> Dict:
@@ -141,60 +268,153 @@ class TelegramClient:
         return result['result']
 
     @classmethod
-    async def _execute_get(cls, url: str, params: Dict = None) -> Dict:
-        async with httpx.AsyncClient() as client:
+    async def _execute_get(cls, url: str, params: Dict = None, timeout: float = None) -> Dict:
+        import httpx
+
+        client_kwargs = {'timeout': timeout} if timeout is not None else {}
+        async with httpx.AsyncClient(verify=cls._get_ssl_context(), **client_kwargs) as client:
             response = await client.get(url, params=params)
             response.raise_for_status()
         return response.json()
 
     @classmethod
     async def _execute_post(cls, url: str, data: Dict = None) -> Dict:
-        async with httpx.AsyncClient() as client:
+        import httpx
+
+        async with httpx.AsyncClient(verify=cls._get_ssl_context()) as client:
             response = await client.post(url, data=data)
             response.raise_for_status()
         return response.json()
 
+    @classmethod
+    def _get_ssl_context(cls) -> 'ssl.SSLContext':
+        if cls._ssl_context is None:
+            import httpx
+
+            cls._ssl_context = httpx.create_ssl_context(trust_env=True)
+        return cls._ssl_context
+
     async def _receive_update(self, update: objects.Update) -> None:
+        if self._profiler is None:
+            await self._dispatch_update(update)
+        else:
+            with self._profiler.update_span(update):
+                await self._dispatch_update(update)
+
+    async def _dispatch_update(self, update: objects.Update) -> None:
+        if self._state_store is not None:
+            await self._load_state(update)
+
         if update.callback_query:
             await self._handle_callback_query(update.callback_query)
         else:
-            if update.message.entities:
-                command_entities = [entity
-                                    for entity in update.message.entities
-                                    if entity.message_entity_type == objects.MessageEntityType.BOT_COMMAND]
-            else:
-                command_entities = None
-
-            if command_entities:
-                for entity in command_entities:
-                    raw_command = update.message.text[entity.offset: entity.offset + entity.length]
+            raw_commands = update.message.get_entity_texts(objects.MessageEntityType.BOT_COMMAND)
+            if raw_commands:
+                for raw_command in raw_commands:
                     command = raw_command.split('@')[0]
                     await self._handle_command(command, update.message)
             else:
                 await self._handle_message(update.message)
 
+    async def _load_state(self, update: objects.Update) -> None:
+        if update.callback_query:
+            user = update.callback_query.from_user
+            message = update.callback_query.message
+            chat_id = message.chat.id if message else user.id
+        elif update.message:
+            user = update.message.from_user
+            chat_id = update.message.chat.id
+        else:
+            return
+        await self._state_store.load(chat_id, user.id)
+
+    def configure_executor(self, policy: ExecutionPolicy, max_workers: int = None, max_queue_size: int = 100) -> None:
+        """
+        Sets the pool size and queue bound used to run the synchronous handlers registered with the given policy.
+
+        An executor that is already running handlers cannot be reconfigured.
+        """
+        executor = self._executors.get(policy)
+        if executor is not None:
+            if executor.busy:
+                raise ClientError(f'The {policy} executor cannot be reconfigured while handlers are running')
+            executor.shutdown()
+        self._executors[policy] = HandlerExecutor(policy, max_workers=max_workers, max_queue_size=max_queue_size)
+
     def register_command_handler(self, command: str,
-                                 handler: Callable[['TelegramClient', str, objects.Message], Awaitable[None]]) -> None:
-        self._command_handlers[command].append(handler)
+                                 handler: Callable[['TelegramClient', str, objects.Message],
+                                                   Union[Awaitable[None], None]],
+                                 policy: ExecutionPolicy = None) -> None:
+        self._command_handlers[command].append(self._wrap_handler(handler, policy))
 
-    def register_message_handler(self, handler: Callable[['TelegramClient', objects.Message], Awaitable[None]]) -> None:
-        self._message_handlers.append(handler)
+    def register_message_handler(self, handler: Callable[['TelegramClient', objects.Message],
+                                                         Union[Awaitable[None], None]],
+                                 policy: ExecutionPolicy = None) -> None:
+        self._message_handlers.append(self._wrap_handler(handler, policy))
 
     def register_callback_query_handler(self, handler: Callable[['TelegramClient', objects.CallbackQuery],
-                                                                Awaitable[None]]) -> None:
-        self._callback_query_handlers.append(handler)
+                                                                Union[Awaitable[None], None]],
+                                        policy: ExecutionPolicy = None) -> None:
+        self._callback_query_handlers.append(self._wrap_handler(handler, policy))
+
+    def _wrap_handler(self, handler: Callable, policy: Optional[ExecutionPolicy]) -> Callable[..., Awaitable[None]]:
+        """
+        Without a policy, handlers run on the event loop and whatever they return is awaited if it is awaitable, so
+        any callable returning a coroutine works. Callables other than coroutine functions get a TrackingClient, and
+        raise ClientError when they return without awaiting the coroutines of the client methods they called.
+        Synchronous handlers registered with a policy run through the executor of that policy (see HandlerExecutor).
+        """
+        if policy is None:
+            if asyncio.iscoroutinefunction(handler):
+                return handler
+
+            @functools.wraps(handler)
+            async def call(client: 'TelegramClient', *args) -> None:
+                tracking_client = TrackingClient(client)
+                result = handler(tracking_client, *args)
+                if isinstance(result, collections.abc.Awaitable):
+                    await result
+                elif tracking_client.coroutines:
+                    # let the tasks the handler might have created from them start first
+                    await asyncio.sleep(0)
+                    unawaited = tracking_client.close_unawaited()
+                    if unawaited:
+                        raise ClientError(f'{handler!r} did not await {", ".join(unawaited)}: register synchronous '
+                                          f'handlers with an ExecutionPolicy to call the client')
+
+            return call
+
+        if asyncio.iscoroutinefunction(handler) and policy != ExecutionPolicy.INLINE:
+            raise ClientError(f'Coroutine handlers can only run inline, got {policy}')
+
+        @functools.wraps(handler)
+        async def run(client: 'TelegramClient', *args) -> None:
+            if policy not in self._executors:
+                self.configure_executor(policy)
+            await self._executors[policy].submit(client, handler, *args, profiler=self._profiler)
+
+        # the executor traces the handler where it actually runs
+        self._executor_handlers.add(run)
+        return run
 
     async def _handle_message(self, message: objects.Message) -> None:
         for handler in self._message_handlers:
-            await handler(self, message)
+            await self._call_handler(handler, message)
 
     async def _handle_command(self, command: str, message: objects.Message) -> None:
         for handler in self._command_handlers[command]:
-            await handler(self, command, message)
+            await self._call_handler(handler, command, message)
 
     async def _handle_callback_query(self, callback_query: objects.CallbackQuery) -> None:
         for handler in self._callback_query_handlers:
-            await handler(self, callback_query)
+            await self._call_handler(handler, callback_query)
+
+    async def _call_handler(self, handler: Callable[..., Awaitable[None]], *args) -> None:
+        if self._profiler is None or handler in self._executor_handlers:
+            await handler(self, *args)
+        else:
+            with self._profiler.handler_span(handler):
+                await handler(self, *args)
 
     @classmethod
     def _raise_for_error(cls, data: Dict) -> None:
@@ -0,0 +1,308 @@
+from enum import Enum
+from typing import Any, Callable, Coroutine, List, Optional, Set, Tuple, TYPE_CHECKING
+import asyncio
+import collections.abc
+import concurrent.futures
+import contextlib
+import contextvars
+import inspect
+import logging
+import os
+
+
+if TYPE_CHECKING:
+    from py_gram.profiling import Profiler
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionPolicy(Enum):
+    INLINE = 'inline'
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+
+class BlockingClient:
+    """
+    Wraps a TelegramClient for handlers running in a worker thread.
+
+    Calling any of the client's methods runs it on the event loop, as the client and its state store are not thread
+    safe, and blocks until its result is ready.
+    """
+
+    def __init__(self, client, loop: asyncio.AbstractEventLoop):
+        self._client = client
+        self._loop = loop
+
+    def __repr__(self):
+        return f'<BlockingClient(client={self._client})>'
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        if asyncio.iscoroutinefunction(attribute):
+            def call(*args, **kwargs):
+                future = asyncio.run_coroutine_threadsafe(attribute(*args, **kwargs), self._loop)
+                return future.result()
+        else:
+            def call(*args, **kwargs):
+                future = concurrent.futures.Future()
+
+                def run() -> None:
+                    if not future.set_running_or_notify_cancel():
+                        return
+                    try:
+                        future.set_result(attribute(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+
+                self._loop.call_soon_threadsafe(run)
+                return future.result()
+
+        return call
+
+
+class DeferredClient:
+    """
+    Records the client calls of handlers running in a process, which cannot reach the client.
+
+    The recorded calls are replayed through the real client once the handler returns, so their results are not
+    available to the handler, and calls whose only purpose is their result (get_*) are rejected.
+    """
+
+    def __init__(self):
+        self.calls: List[Tuple[str, Tuple, dict]] = []
+
+    def __repr__(self):
+        return f'<DeferredClient(calls={len(self.calls)})>'
+
+    def __getattr__(self, name: str) -> Callable[..., None]:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name.startswith('get_'):
+            from py_gram.client import ClientError
+
+            raise ClientError(f'{name} cannot return a value to a handler running in a process')
+
+        def call(*args, **kwargs) -> None:
+            self.calls.append((name, args, kwargs))
+
+        return call
+
+
+class InlineClient(DeferredClient):
+    """
+    Wraps a TelegramClient for synchronous handlers running inline on the event loop.
+
+    The synchronous methods are those of the client, while calls to its coroutine methods are recorded and replayed
+    once the handler returns, like for a DeferredClient.
+    """
+
+    def __init__(self, client):
+        super().__init__()
+        self._client = client
+
+    def __repr__(self):
+        return f'<InlineClient(client={self._client}, calls={len(self.calls)})>'
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        if asyncio.iscoroutinefunction(attribute):
+            return super().__getattr__(name)
+        return attribute
+
+
+class TrackingClient:
+    """
+    Wraps a TelegramClient for handlers registered without a policy, which may or may not be coroutine functions.
+
+    Calls are passed through to the client, while the coroutines returned by its coroutine methods are kept, so the
+    client can tell when a synchronous handler never awaited them.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.coroutines: List[Tuple[str, Coroutine]] = []
+
+    def __repr__(self):
+        return f'<TrackingClient(client={self._client})>'
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        def call(*args, **kwargs) -> Coroutine:
+            coroutine = attribute(*args, **kwargs)
+            self.coroutines.append((name, coroutine))
+            return coroutine
+
+        return call
+
+    def close_unawaited(self) -> List[str]:
+        """
+        Closes the coroutines that were never started, and returns the names of the methods that returned them.
+        """
+        names = []
+        for name, coroutine in self.coroutines:
+            if inspect.getcoroutinestate(coroutine) == inspect.CORO_CREATED:
+                coroutine.close()
+                names.append(name)
+        return names
+
+
+def _run_deferred(handler: Callable, args: Tuple) -> List[Tuple[str, Tuple, dict]]:
+    client = DeferredClient()
+    handler(client, *args)
+    return client.calls
+
+
+async def _await_result(result: Any) -> Any:
+    if isinstance(result, collections.abc.Awaitable):
+        return await result
+    return result
+
+
+def _handler_span(profiler: Optional['Profiler'], handler: Callable, sample_stacks: bool = True):
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.handler_span(handler, sample_stacks=sample_stacks)
+
+
+def _call_traced(profiler: Optional['Profiler'], handler: Callable, *args) -> None:
+    with _handler_span(profiler, handler):
+        handler(*args)
+
+
+class HandlerExecutor:
+    """
+    Runs synchronous handlers according to an execution policy.
+
+    Inline handlers run on the event loop, with the client itself if they are coroutine functions or an InlineClient
+    otherwise. Thread handlers get a BlockingClient, and process handlers a DeferredClient.
+
+    Pooled handlers run off the event loop, so polling and other chats are not held up by them. At most `max_workers`
+    handlers run at a time, and at most `max_queue_size` more wait for a worker. Once the queue is full, submitting
+    the next handler waits for a free slot, which applies back pressure on the updates worker.
+    """
+
+    def __init__(self, policy: ExecutionPolicy, max_workers: int = None, max_queue_size: int = 100):
+        if max_workers is not None and max_workers <= 0:
+            raise ValueError('max_workers must be a positive number')
+        if max_queue_size < 0:
+            raise ValueError('max_queue_size must not be negative')
+        self.policy = policy
+        if policy == ExecutionPolicy.INLINE:
+            max_workers = 1
+        elif max_workers is None:
+            # same defaults as the concurrent.futures pools
+            cpu_count = os.cpu_count() or 1
+            max_workers = min(32, cpu_count + 4) if policy == ExecutionPolicy.THREAD else cpu_count
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._pool: Optional[concurrent.futures.Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._pool_futures: Set[concurrent.futures.Future] = set()
+
+    def __repr__(self):
+        return f'<HandlerExecutor(policy={self.policy}, max_workers={self.max_workers}, ' \
+               f'max_queue_size={self.max_queue_size})>'
+
+    async def submit(self, client, handler: Callable, *args, profiler: 'Profiler' = None) -> None:
+        """
+        Runs the handler inline, or waits for a free slot and starts running it in the pool without waiting for it to
+        complete. Handlers running in a pool may therefore complete out of order.
+
+        With a profiler, the handler span covers the execution of the handler itself, in the worker thread for
+        thread handlers.
+        """
+        if self.policy == ExecutionPolicy.INLINE:
+            await self._run(client, handler, args, profiler)
+            return
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers + self.max_queue_size)
+        await self._slots.acquire()
+        task = asyncio.get_running_loop().create_task(self._run(client, handler, args, profiler))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._tasks or self._pool_futures)
+
+    async def join(self) -> None:
+        """
+        Waits for all the submitted handlers to complete.
+        """
+        while self._tasks or self._pool_futures:
+            if self._tasks:
+                await asyncio.wait(list(self._tasks))
+            # a handler keeps running in the pool when the task awaiting it is cancelled (e.g. on SIGTERM), and may
+            # still call the client on the event loop
+            futures = [asyncio.wrap_future(future) for future in list(self._pool_futures)]
+            if futures:
+                await asyncio.wait(futures)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shuts the pool down. Call join first when the event loop is running, as waiting for a handler that calls the
+        client would block the loop it waits for.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+        # the semaphore belongs to the event loop that used it
+        self._slots = None
+
+    async def _run(self, client, handler: Callable, args: Tuple, profiler: Optional['Profiler']) -> None:
+        loop = asyncio.get_running_loop()
+        if self.policy == ExecutionPolicy.THREAD:
+            # the context carries the span of the update being handled over to the worker thread
+            context = contextvars.copy_context()
+            await self._run_in_pool(context.run, _call_traced, profiler, handler, BlockingClient(client, loop), *args)
+            return
+
+        if self.policy == ExecutionPolicy.PROCESS:
+            # the stacks of another process cannot be sampled
+            with _handler_span(profiler, handler, sample_stacks=False):
+                calls = await self._run_in_pool(_run_deferred, handler, args)
+        elif asyncio.iscoroutinefunction(handler):
+            with _handler_span(profiler, handler):
+                await handler(client, *args)
+            return
+        else:
+            inline_client = InlineClient(client)
+            with _handler_span(profiler, handler):
+                await _await_result(handler(inline_client, *args))
+            calls = inline_client.calls
+
+        for name, call_args, call_kwargs in calls:
+            await _await_result(getattr(client, name)(*call_args, **call_kwargs))
+
+    async def _run_in_pool(self, function: Callable, *args) -> Any:
+        # unlike the task awaiting it, the pool future tracks the handler until it actually completes
+        future = self._get_pool().submit(function, *args)
+        self._pool_futures.add(future)
+        future.add_done_callback(self._pool_futures.discard)
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Handler failed', exc_info=task.exception())
+
+    def _get_pool(self) -> concurrent.futures.Executor:
+        if self._pool is None:
+            if self.policy == ExecutionPolicy.THREAD:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                   thread_name_prefix='py_gram-handler')
+            elif self.policy == ExecutionPolicy.PROCESS:
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                raise ValueError(f'{self.policy} does not use a pool')
+        return self._pool
@@ -1,9 +1,6 @@
 from enum import Enum
-from typing import Dict, List, Type
+from typing import Dict, List, Optional
 import abc
-import dataclasses
-import inspect
-import typing
 
 
 class ChatType(Enum):
@@ -31,6 +28,13 @@ class MessageEntityType(Enum):
     TEXT_MENTION = 'text_mention'
 
 
+# value lookups that skip the Enum call machinery when parsing updates, unknown values still raise a ValueError
+_CHAT_TYPES_BY_VALUE: Dict[str, ChatType] = {chat_type.value: chat_type for chat_type in ChatType}
+_MESSAGE_ENTITY_TYPES_BY_VALUE: Dict[str, MessageEntityType] = {
+    message_entity_type.value: message_entity_type for message_entity_type in MessageEntityType
+}
+
+
 class User:
     """
     https://core.telegram.org/bots/api#user
@@ -64,7 +68,11 @@ class Chat:
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'Chat':
-        chat_type = ChatType(data.pop('type'))
+        value = data.pop('type')
+        try:
+            chat_type = _CHAT_TYPES_BY_VALUE[value]
+        except KeyError:
+            chat_type = ChatType(value)
         return cls(chat_type=chat_type, **data)
 
     def __repr__(self):
@@ -86,7 +94,11 @@ class MessageEntity:
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'MessageEntity':
-        message_entity_type = MessageEntityType(data.pop('type'))
+        value = data.pop('type')
+        try:
+            message_entity_type = _MESSAGE_ENTITY_TYPES_BY_VALUE[value]
+        except KeyError:
+            message_entity_type = MessageEntityType(value)
         return cls(message_entity_type=message_entity_type, **data)
 
 
@@ -104,6 +116,7 @@ class Message:
         self.kwargs = kwargs
         self.message_id = message_id
         self.text = text
+        self._entity_texts: Optional[Dict[MessageEntityType, List[str]]] = None
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'Message':
@@ -123,6 +136,44 @@ class Message:
     def __repr__(self):
         return f'<Message(message_id={self.message_id}, text={self.text}, chat={self.chat}, user={self.from_user})>'
 
+    @property
+    def entity_texts(self) -> Dict[MessageEntityType, List[str]]:
+        """
+        The texts of the message entities grouped by type, in order of appearance.
+
+        Entity offsets and lengths are in UTF-16 code units, so they are converted in a single pass over the entities
+        the first time this is accessed, and the result is cached.
+        """
+        if self._entity_texts is None:
+            self._entity_texts = self._extract_entity_texts()
+        return self._entity_texts
+
+    def get_entity_texts(self, message_entity_type: MessageEntityType) -> List[str]:
+        return self.entity_texts.get(message_entity_type, [])
+
+    def _extract_entity_texts(self) -> Dict[MessageEntityType, List[str]]:
+        entity_texts: Dict[MessageEntityType, List[str]] = {}
+        if not self.entities or not self.text:
+            return entity_texts
+
+        text = self.text
+        if text.isascii() or max(text) < '\U00010000':
+            # without astral characters UTF-16 code units match code points
+            def extract(offset: int, length: int) -> str:
+                return text[offset: offset + length]
+        else:
+            encoded_text = text.encode('utf-16-le')
+
+            def extract(offset: int, length: int) -> str:
+                return encoded_text[offset * 2: (offset + length) * 2].decode('utf-16-le', errors='surrogatepass')
+
+        for entity in self.entities:
+            if entity is None:
+                continue
+            entity_text = extract(entity.offset, entity.length)
+            entity_texts.setdefault(entity.message_entity_type, []).append(entity_text)
+        return entity_texts
+
 
 class CallbackQuery:
     """
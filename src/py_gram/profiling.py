@@ -0,0 +1,238 @@
+from typing import Callable, Dict, Iterator, List, Optional
+import abc
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import traceback
+
+from py_gram import objects
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileRecord:
+    """
+    A finished tracing span: the handling of an update, or one handler invocation within it.
+    """
+
+    def __init__(self, name: str, update_id: int, chat_id: Optional[int], handler: Optional[str], started_at: float,
+                 duration: float, slow: bool, samples: List[List[str]] = None):
+        self.name = name
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.handler = handler
+        self.started_at = started_at
+        self.duration = duration
+        self.slow = slow
+        self.samples = samples or []
+
+    def __repr__(self):
+        return f'<ProfileRecord(name={self.name}, update_id={self.update_id}, handler={self.handler}, ' \
+               f'duration={self.duration:.6f}, slow={self.slow})>'
+
+    def to_dict(self) -> Dict:
+        data = {
+            'name': self.name,
+            'update_id': self.update_id,
+            'chat_id': self.chat_id,
+            'handler': self.handler,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'slow': self.slow,
+        }
+        if self.samples:
+            data['samples'] = self.samples
+        return data
+
+
+class ProfileSink(abc.ABC):
+    @abc.abstractmethod
+    def emit(self, record: ProfileRecord) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class LoggingSink(ProfileSink):
+    def __init__(self, logger_name: str = __name__, level: int = logging.INFO, slow_level: int = logging.WARNING):
+        self._logger = logging.getLogger(logger_name)
+        self._level = level
+        self._slow_level = slow_level
+
+    def emit(self, record: ProfileRecord) -> None:
+        level = self._slow_level if record.slow else self._level
+        self._logger.log(level, '%s', json.dumps(record.to_dict()))
+
+
+class FileSink(ProfileSink):
+    """
+    Appends the records to a file, one JSON object per line.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def emit(self, record: ProfileRecord) -> None:
+        line = json.dumps(record.to_dict())
+        with self._lock:
+            self._file.write(f'{line}\n')
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class CallbackSink(ProfileSink):
+    def __init__(self, callback: Callable[[ProfileRecord], None]):
+        self._callback = callback
+
+    def emit(self, record: ProfileRecord) -> None:
+        self._callback(record)
+
+
+class _Span:
+    def __init__(self, span_id: int, name: str, update_id: int, chat_id: Optional[int], handler: Optional[str]):
+        self.span_id = span_id
+        self.name = name
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.handler = handler
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.samples: List[List[str]] = []
+
+
+_current_span: 'contextvars.ContextVar[Optional[_Span]]' = contextvars.ContextVar('py_gram_current_span',
+                                                                                  default=None)
+
+
+class Profiler:
+    """
+    Opt-in tracing of update handling, reported to a pluggable sink.
+
+    A `sample_rate` fraction of the updates is traced: the handling of each traced update and every handler invocation
+    within it become spans carrying the update_id, chat id and handler name. Handlers that run in a thread pool are
+    traced in their worker thread, and those that run in a process pool are timed without stack samples.
+
+    With a `slow_threshold`, a sampler thread captures the stack of the thread running a span every `sample_interval`
+    seconds once the span has run longer than the threshold (up to `max_samples` stacks per span), and spans lasting
+    longer than the threshold are flagged as slow. With `slow_only`, only slow spans are reported.
+    """
+
+    def __init__(self, sink: ProfileSink, sample_rate: float = 1.0, slow_threshold: float = None,
+                 sample_interval: float = 0.01, max_samples: int = 20, slow_only: bool = False):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError('sample_rate must be between 0 and 1')
+        self._sink = sink
+        self._sample_rate = sample_rate
+        self._slow_threshold = slow_threshold
+        self._sample_interval = sample_interval
+        self._max_samples = max_samples
+        self._slow_only = slow_only
+        self._span_ids = itertools.count()
+        self._active_spans: Dict[int, _Span] = {}
+        self._sampler: Optional[threading.Thread] = None
+        # spans start in thread pool workers as well
+        self._sampler_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def __repr__(self):
+        return f'<Profiler(sink={self._sink}, sample_rate={self._sample_rate}, ' \
+               f'slow_threshold={self._slow_threshold})>'
+
+    @contextlib.contextmanager
+    def update_span(self, update: objects.Update) -> Iterator[None]:
+        """
+        Traces the handling of the update, if it is sampled.
+        """
+        if self._sample_rate < 1 and random.random() >= self._sample_rate:
+            yield
+            return
+
+        if update.callback_query:
+            message = update.callback_query.message
+            chat_id = message.chat.id if message else None
+        else:
+            chat_id = update.message.chat.id if update.message else None
+        with self._span('receive_update', update.update_id, chat_id, None, True):
+            yield
+
+    @contextlib.contextmanager
+    def handler_span(self, handler: Callable, sample_stacks: bool = True) -> Iterator[None]:
+        """
+        Traces a handler invocation in the current thread, if the update it handles is traced.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            yield
+            return
+
+        handler_name = getattr(handler, '__qualname__', repr(handler))
+        with self._span('handler', parent.update_id, parent.chat_id, handler_name, sample_stacks):
+            yield
+
+    def close(self) -> None:
+        with self._sampler_lock:
+            self._stopped.set()
+            if self._sampler is not None:
+                self._sampler.join()
+                self._sampler = None
+        self._sink.close()
+
+    @contextlib.contextmanager
+    def _span(self, name: str, update_id: int, chat_id: Optional[int], handler: Optional[str],
+              sample_stacks: bool) -> Iterator[None]:
+        span = _Span(next(self._span_ids), name, update_id, chat_id, handler)
+        token = _current_span.set(span)
+        if self._slow_threshold is not None and sample_stacks:
+            self._active_spans[span.span_id] = span
+            self._start_sampler()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - span.start
+            self._active_spans.pop(span.span_id, None)
+            _current_span.reset(token)
+            self._emit(span, duration)
+
+    def _emit(self, span: _Span, duration: float) -> None:
+        slow = self._slow_threshold is not None and duration >= self._slow_threshold
+        if self._slow_only and not slow:
+            return
+        record = ProfileRecord(span.name, span.update_id, span.chat_id, span.handler, span.started_at, duration, slow,
+                               list(span.samples))
+        try:
+            self._sink.emit(record)
+        except Exception:
+            logger.exception('Failed to emit %s', record)
+
+    def _start_sampler(self) -> None:
+        with self._sampler_lock:
+            if self._sampler is None:
+                self._stopped.clear()
+                self._sampler = threading.Thread(target=self._sample, name='py_gram-profiler', daemon=True)
+                self._sampler.start()
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self._sample_interval):
+            now = time.perf_counter()
+            slow_spans = [span for span in list(self._active_spans.values())
+                          if now - span.start >= self._slow_threshold and len(span.samples) < self._max_samples]
+            if not slow_spans:
+                continue
+            frames = sys._current_frames()
+            for span in slow_spans:
+                frame = frames.get(span.thread_id)
+                if frame is not None:
+                    span.samples.append(traceback.format_stack(frame))
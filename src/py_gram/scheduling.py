@@ -0,0 +1,158 @@
+from enum import Enum
+from typing import Callable, Deque, Dict, Iterable, Optional, Tuple
+import asyncio
+import collections
+import time
+
+from py_gram import objects
+
+
+class UpdatePriority(Enum):
+    """
+    Priority classes of inbound updates, from the most urgent to the least.
+    """
+    CALLBACK_QUERY = 0
+    COMMAND = 1
+    MESSAGE = 2
+
+
+class SheddingPolicy(Enum):
+    # discard the shed updates
+    DROP = 'drop'
+    # dispatch the shed updates once no other update is pending
+    DEFER = 'defer'
+
+
+class PriorityScheduler:
+    """
+    Orders pending updates by priority class: callback queries first, then commands, then plain messages.
+
+    Each class has its own queue, optionally bounded by `max_queue_sizes`. Updates of the `shed_priorities` classes
+    are shed when their queue is full, or when they waited longer than `lag_threshold` seconds by the time they are
+    dispatched. Shed updates are dropped or deferred according to the `shedding_policy`, and are passed to `on_shed`
+    when dropped. A full queue of a class that cannot be shed makes `put` wait for room instead.
+
+    Delivery: polling confirms the updates received so far to Telegram, so the updates worker stops polling while
+    `max_pending` updates or more are pending, and dispatches the pending updates before it returns, including when it
+    is cancelled. Every update is therefore dispatched at least once, unless it is dropped by shedding, or the process
+    dies with up to `max_pending` updates pending.
+    """
+
+    def __init__(self, max_queue_sizes: Dict[UpdatePriority, int] = None, lag_threshold: float = None,
+                 shedding_policy: SheddingPolicy = SheddingPolicy.DROP,
+                 shed_priorities: Iterable[UpdatePriority] = (UpdatePriority.MESSAGE,), max_deferred: int = 1000,
+                 on_shed: Callable[[objects.Update], None] = None, max_pending: int = 100):
+        if max_pending <= 0:
+            raise ValueError('max_pending must be a positive number')
+        self._max_queue_sizes = max_queue_sizes or {}
+        self._lag_threshold = lag_threshold
+        self._shedding_policy = shedding_policy
+        self._shed_priorities = frozenset(shed_priorities)
+        self._max_deferred = max_deferred
+        self._on_shed = on_shed
+        self._max_pending = max_pending
+        self._queues: Dict[UpdatePriority, Deque[Tuple[float, objects.Update]]] = {
+            priority: collections.deque() for priority in UpdatePriority
+        }
+        self._deferred: Deque[objects.Update] = collections.deque()
+        self._dropped_count = 0
+        self._available: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values()) + len(self._deferred)
+
+    def __repr__(self):
+        sizes = ', '.join(f'{priority.name.lower()}={len(queue)}' for priority, queue in self._queues.items())
+        return f'<PriorityScheduler({sizes}, deferred={len(self._deferred)}, dropped={self._dropped_count})>'
+
+    @property
+    def dropped_count(self) -> int:
+        return self._dropped_count
+
+    @property
+    def deferred_count(self) -> int:
+        return len(self._deferred)
+
+    @classmethod
+    def classify(cls, update: objects.Update) -> UpdatePriority:
+        if update.callback_query:
+            return UpdatePriority.CALLBACK_QUERY
+        if update.message and update.message.get_entity_texts(objects.MessageEntityType.BOT_COMMAND):
+            return UpdatePriority.COMMAND
+        return UpdatePriority.MESSAGE
+
+    async def put(self, update: objects.Update) -> None:
+        self._create_events()
+        priority = self.classify(update)
+        queue = self._queues[priority]
+        max_queue_size = self._max_queue_sizes.get(priority)
+        while max_queue_size is not None and len(queue) >= max_queue_size:
+            if priority in self._shed_priorities:
+                self._shed(update)
+                self._available.set()
+                return
+            self._space.clear()
+            await self._space.wait()
+
+        queue.append((time.monotonic(), update))
+        self._available.set()
+
+    async def wait_for_room(self) -> None:
+        """
+        Waits until fewer than `max_pending` updates are pending.
+        """
+        self._create_events()
+        while len(self) >= self._max_pending:
+            self._space.clear()
+            await self._space.wait()
+
+    async def get(self) -> objects.Update:
+        """
+        Waits for the most urgent pending update and returns it.
+        """
+        self._create_events()
+        while True:
+            update = self.get_nowait()
+            if update is not None:
+                return update
+            self._available.clear()
+            await self._available.wait()
+
+    def get_nowait(self) -> Optional[objects.Update]:
+        """
+        Returns the most urgent pending update, or None if there is none.
+        """
+        now = None
+        for priority, queue in self._queues.items():
+            while queue:
+                enqueued_at, update = queue.popleft()
+                if self._space is not None:
+                    self._space.set()
+                if self._lag_threshold is not None and priority in self._shed_priorities:
+                    now = now if now is not None else time.monotonic()
+                    if now - enqueued_at > self._lag_threshold:
+                        self._shed(update)
+                        continue
+                return update
+
+        if self._deferred:
+            if self._space is not None:
+                self._space.set()
+            return self._deferred.popleft()
+        return None
+
+    def _shed(self, update: objects.Update) -> None:
+        if self._shedding_policy == SheddingPolicy.DEFER and len(self._deferred) < self._max_deferred:
+            self._deferred.append(update)
+            return
+
+        self._dropped_count += 1
+        if self._on_shed is not None:
+            self._on_shed(update)
+
+    def _create_events(self) -> None:
+        # created lazily, so they belong to the running event loop
+        if self._available is None:
+            self._available = asyncio.Event()
+            self._space = asyncio.Event()
@@ -0,0 +1,235 @@
+from typing import Dict, Optional, Tuple
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import sqlite3
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+StateKey = Tuple[int, int]
+
+
+class StateNotLoadedError(LookupError):
+    """
+    Raised when reading a state that is not in memory, which has to be read from the database with `StateStore.load`.
+    """
+
+
+class StateStore:
+    """
+    Per-chat conversation state keyed by (Chat.id, User.id).
+
+    Recently used entries live in a bounded in-memory LRU tier, so reading and updating state from a handler never
+    touches the disk. Updated entries are marked dirty and written behind in batches to a local SQLite database by a
+    background task (see start/stop), or explicitly via flush.
+    """
+
+    TABLE_NAME = 'py_gram_state'
+
+    def __init__(self, path: str = ':memory:', capacity: int = 1024, flush_interval: float = 1.0,
+                 batch_size: int = 100):
+        if capacity <= 0:
+            raise ValueError('capacity must be a positive number')
+        self._path = path
+        self._capacity = capacity
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._cache: 'collections.OrderedDict[StateKey, Dict]' = collections.OrderedDict()
+        # a value of None marks a deleted entry
+        self._dirty: Dict[StateKey, Optional[Dict]] = {}
+        # entries of the batch being written, still served to readers until the write completes
+        self._flushing: Dict[StateKey, Optional[Dict]] = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.TABLE_NAME} ('
+            f'chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL, state TEXT NOT NULL, '
+            f'PRIMARY KEY (chat_id, user_id))'
+        )
+        self._connection.commit()
+        self._lock = threading.Lock()
+        # a single worker keeps all database writes ordered
+        self._io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='py_gram-state')
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __repr__(self):
+        return f'<StateStore(path={self._path}, capacity={self._capacity}, cached={len(self._cache)}, ' \
+               f'dirty={len(self._dirty)})>'
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def get(self, chat_id: int, user_id: int) -> Dict:
+        """
+        Returns the state of the given chat and user (an empty dict if none was stored).
+
+        Entries loaded by `load` (which the client does before dispatching an update) are served from memory. A miss
+        raises StateNotLoadedError rather than reading from the database on the event loop.
+        """
+        key = (chat_id, user_id)
+        try:
+            state = self._cache[key]
+        except KeyError:
+            state = self._read_pending(key)
+            if state is None:
+                raise StateNotLoadedError(f'The state of {key} is not in memory, load it first') from None
+            self._put(key, state)
+        else:
+            self._cache.move_to_end(key)
+        return state
+
+    def set(self, chat_id: int, user_id: int, state: Dict) -> None:
+        """
+        Replaces the state of the given chat and user, and schedules it to be written behind.
+
+        Call it after mutating a dict returned by `get` as well, so the change gets persisted.
+        """
+        key = (chat_id, user_id)
+        self._put(key, state)
+        self._mark_dirty(key, state)
+
+    def delete(self, chat_id: int, user_id: int) -> None:
+        key = (chat_id, user_id)
+        self._cache.pop(key, None)
+        self._mark_dirty(key, None)
+
+    async def load(self, chat_id: int, user_id: int) -> Dict:
+        """
+        Makes sure the state of the given chat and user is in memory, reading it from the database off the event loop
+        if necessary.
+        """
+        key = (chat_id, user_id)
+        if key not in self._cache and self._read_pending(key) is None:
+            loop = asyncio.get_running_loop()
+            state = await loop.run_in_executor(self._io_executor, self._read_row, key)
+            # the entry might have been set or deleted while reading, in which case the row read is stale
+            if key not in self._cache and key not in self._dirty and key not in self._flushing:
+                self._put(key, state)
+        return self.get(chat_id, user_id)
+
+    async def flush(self) -> None:
+        """
+        Writes all dirty entries to the database in a single transaction.
+
+        Entries whose state cannot be serialized to JSON are logged and left out of the batch, so they do not hold up
+        the others. They stay in memory until evicted.
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        self._flushing = dirty
+        try:
+            # serialize on the loop, so later in-place mutations of the states cannot race with the write
+            batch = []
+            for key, state in dirty.items():
+                try:
+                    batch.append((key, json.dumps(state) if state is not None else None))
+                except (TypeError, ValueError):
+                    logger.exception('Failed to serialize the state of %s, which is not persisted', key)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._io_executor, self._write, batch)
+        except BaseException:
+            # keep the entries that were not updated since, so the next flush retries them
+            for key, state in dirty.items():
+                self._dirty.setdefault(key, state)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def start(self) -> None:
+        """
+        Starts the write-behind task, which flushes every `flush_interval` seconds or as soon as `batch_size` entries
+        are dirty.
+        """
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        self._flush_requested = asyncio.Event()
+        self._flush_task = asyncio.get_running_loop().create_task(self._write_behind())
+
+    async def stop(self) -> None:
+        """
+        Stops the write-behind task and flushes the remaining dirty entries.
+        """
+        if self._flush_task is not None:
+            # asked to stop rather than cancelled, as a cancellation racing with the wakeup of wait_for can be lost
+            self._stopping = True
+            self._flush_requested.set()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._flush_task = None
+                self._stopping = False
+        await self.flush()
+
+    def close(self) -> None:
+        self._io_executor.shutdown(wait=True)
+        with self._lock:
+            self._connection.close()
+
+    async def _write_behind(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # the entries are kept dirty, so the next flush retries them
+                logger.exception('Failed to write the state behind')
+
+    def _put(self, key: StateKey, state: Dict) -> None:
+        self._cache[key] = state
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._capacity:
+            # dirty entries are kept in self._dirty until flushed, so evicting them loses nothing
+            self._cache.popitem(last=False)
+
+    def _mark_dirty(self, key: StateKey, state: Optional[Dict]) -> None:
+        self._dirty[key] = state
+        if self._flush_requested is not None and len(self._dirty) >= self._batch_size:
+            self._flush_requested.set()
+
+    def _read_pending(self, key: StateKey) -> Optional[Dict]:
+        """
+        Returns the state of an entry waiting to be written, or None if there is none.
+        """
+        for pending in (self._dirty, self._flushing):
+            try:
+                state = pending[key]
+            except KeyError:
+                continue
+            return state if state is not None else {}
+        return None
+
+    def _read_row(self, key: StateKey) -> Dict:
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT state FROM {self.TABLE_NAME} WHERE chat_id = ? AND user_id = ?', key,
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _write(self, batch) -> None:
+        upserts = [(chat_id, user_id, state) for (chat_id, user_id), state in batch if state is not None]
+        deletes = [(chat_id, user_id) for (chat_id, user_id), state in batch if state is None]
+        with self._lock, self._connection:
+            if upserts:
+                self._connection.executemany(
+                    f'INSERT OR REPLACE INTO {self.TABLE_NAME} (chat_id, user_id, state) VALUES (?, ?, ?)', upserts,
+                )
+            if deletes:
+                self._connection.executemany(
+                    f'DELETE FROM {self.TABLE_NAME} WHERE chat_id = ? AND user_id = ?', deletes,
+                )
@@ -0,0 +1,242 @@
+from datetime import datetime
+import asyncio
+import threading
+import time
+
+from pytest_httpx import HTTPXMock
+import httpx
+import pytest
+
+from py_gram import objects
+from py_gram import ClientError
+from py_gram import ExecutionPolicy
+from py_gram import TelegramClient
+from py_gram import StateNotLoadedError
+from py_gram import StateStore
+from py_gram.executors import DeferredClient
+from py_gram.executors import HandlerExecutor
+
+
+def reply_upper(client: TelegramClient, message: objects.Message) -> None:
+    client.send_message(message.chat.id, text=message.text.upper())
+
+
+class TestExecutors:
+    BOT_TOKEN = 'test-token'
+    BASE_URL = TelegramClient.BASE_URL_FORMAT.format(bot_token=BOT_TOKEN)
+    CHAT_ID = 1965
+
+    @classmethod
+    def _add_responses(cls, httpx_mock: HTTPXMock) -> None:
+        message_response = {
+            'message_id': 506,
+            'date': int(datetime.utcnow().timestamp()),
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'John'},
+            'chat': {'id': cls.CHAT_ID, 'type': objects.ChatType.PRIVATE.value},
+            'text': 'hello',
+        }
+        httpx_mock.add_response(url=f'{cls.BASE_URL}/getUpdates', json={
+            'ok': True,
+            'result': [{'update_id': 88, 'message': message_response}],
+        })
+        httpx_mock.add_response(url=f'{cls.BASE_URL}/sendMessage', json={
+            'ok': True,
+            'result': dict(message_response, text='HELLO'),
+        })
+
+    @classmethod
+    def _start_listening(cls, client: TelegramClient) -> None:
+        try:
+            client.start_listening_for_updates()
+        except httpx.TimeoutException:
+            pass
+
+    @classmethod
+    def _sent_texts(cls, httpx_mock: HTTPXMock):
+        return [request.read().decode() for request in httpx_mock.get_requests()
+                if request.url.path.endswith('/sendMessage')]
+
+    @pytest.mark.parametrize('policy', [ExecutionPolicy.THREAD, ExecutionPolicy.PROCESS, ExecutionPolicy.INLINE])
+    def test_sync_handler_replies_through_client(self, policy, httpx_mock: HTTPXMock):
+        self._add_responses(httpx_mock)
+        client = TelegramClient(self.BOT_TOKEN)
+        client.configure_executor(policy, max_workers=1, max_queue_size=1)
+        client.register_message_handler(reply_upper, policy=policy)
+
+        self._start_listening(client)
+
+        sent_texts = self._sent_texts(httpx_mock)
+        assert len(sent_texts) == 1
+        assert 'text=HELLO' in sent_texts[0]
+
+    def test_thread_handler_runs_off_loop(self, httpx_mock: HTTPXMock):
+        self._add_responses(httpx_mock)
+        client = TelegramClient(self.BOT_TOKEN)
+        handler_thread: threading.Thread = None
+
+        def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            nonlocal handler_thread
+            handler_thread = threading.current_thread()
+            sent = c.send_message(msg.chat.id, text=msg.text.upper())
+            assert sent.text == 'HELLO'
+
+        client.register_message_handler(message_handler, policy=ExecutionPolicy.THREAD)
+        self._start_listening(client)
+
+        assert handler_thread is not None
+        assert handler_thread is not threading.main_thread()
+
+    @pytest.mark.parametrize('policy', [ExecutionPolicy.THREAD, ExecutionPolicy.INLINE])
+    def test_sync_handler_updates_state(self, policy, httpx_mock: HTTPXMock):
+        self._add_responses(httpx_mock)
+        store = StateStore(batch_size=1)
+        client = TelegramClient(self.BOT_TOKEN, state_store=store)
+
+        def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            state = c.get_state(msg.chat.id, msg.from_user.id)
+            c.set_state(msg.chat.id, msg.from_user.id, dict(state, count=state.get('count', 0) + 1))
+
+        client.register_message_handler(message_handler, policy=policy)
+        self._start_listening(client)
+
+        assert store.get(self.CHAT_ID, 1) == {'count': 1}
+        assert store.dirty_count == 0
+        store.close()
+
+    def test_thread_handler_loads_state_not_in_memory(self, httpx_mock: HTTPXMock):
+        self._add_responses(httpx_mock)
+        client = TelegramClient(self.BOT_TOKEN, state_store=StateStore())
+        states = []
+
+        def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            with pytest.raises(StateNotLoadedError):
+                c.get_state(msg.chat.id, 2)
+            states.append(c.load_state(msg.chat.id, 2))
+
+        client.register_message_handler(message_handler, policy=ExecutionPolicy.THREAD)
+        self._start_listening(client)
+
+        assert states == [{}]
+        client.state_store.close()
+
+    def test_handlers_returning_coroutines_are_awaited(self, httpx_mock: HTTPXMock):
+        self._add_responses(httpx_mock)
+        client = TelegramClient(self.BOT_TOKEN)
+        handled = []
+
+        class MessageHandler:
+            async def __call__(self, c: TelegramClient, msg: objects.Message) -> None:
+                handled.append('callable')
+
+        async def message_handler(c: TelegramClient, msg: objects.Message, name: str) -> None:
+            handled.append(name)
+
+        client.register_message_handler(MessageHandler())
+        client.register_message_handler(lambda c, msg: message_handler(c, msg, 'lambda'))
+        self._start_listening(client)
+
+        assert handled == ['callable', 'lambda']
+
+    @pytest.mark.asyncio
+    async def test_sync_handler_without_policy_must_await_client_calls(self):
+        client = TelegramClient(self.BOT_TOKEN)
+        scheduled = []
+
+        def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            c.send_message(self.CHAT_ID, text='hello')
+
+        def scheduling_handler(c: TelegramClient, msg: objects.Message) -> None:
+            scheduled.append(asyncio.ensure_future(c.get_me()))
+
+        async def get_me() -> None:
+            pass
+
+        client.get_me = get_me
+        client.register_message_handler(scheduling_handler)
+        await client._handle_message(None)
+        await asyncio.gather(*scheduled)
+
+        client.register_message_handler(message_handler)
+        with pytest.raises(ClientError):
+            await client._handle_message(None)
+
+    def test_deferred_client_rejects_getters(self):
+        client = DeferredClient()
+        client.send_message(self.CHAT_ID, text='hello')
+
+        with pytest.raises(ClientError):
+            client.get_state(self.CHAT_ID, 1)
+        assert client.calls == [('send_message', (self.CHAT_ID,), {'text': 'hello'})]
+
+    def test_coroutine_handler_cannot_be_offloaded(self):
+        client = TelegramClient(self.BOT_TOKEN)
+
+        async def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            pass
+
+        with pytest.raises(ClientError):
+            client.register_message_handler(message_handler, policy=ExecutionPolicy.THREAD)
+
+    @pytest.mark.asyncio
+    async def test_queue_bound_applies_back_pressure(self):
+        executor = HandlerExecutor(ExecutionPolicy.THREAD, max_workers=1, max_queue_size=1)
+        release = threading.Event()
+
+        def blocking_handler(c, value: int) -> None:
+            release.wait(timeout=5)
+
+        await executor.submit(None, blocking_handler, 1)
+        await executor.submit(None, blocking_handler, 2)
+        third = asyncio.ensure_future(executor.submit(None, blocking_handler, 3))
+        await asyncio.sleep(0.05)
+        assert not third.done()
+
+        release.set()
+        await third
+        await executor.join()
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_join_waits_for_running_handlers_of_cancelled_tasks(self):
+        executor = HandlerExecutor(ExecutionPolicy.THREAD, max_workers=1)
+        started = threading.Event()
+        sent = []
+
+        class Client:
+            async def send_message(self, chat_id: int, text: str) -> None:
+                sent.append(text)
+
+        def message_handler(c, chat_id: int) -> None:
+            started.set()
+            time.sleep(0.05)
+            c.send_message(chat_id, text='bye')
+
+        await executor.submit(Client(), message_handler, self.CHAT_ID)
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        # like the signal handler of the updates worker
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+        await asyncio.wait_for(executor.join(), timeout=5)
+        executor.shutdown()
+
+        assert sent == ['bye']
+
+    @pytest.mark.asyncio
+    async def test_busy_executor_cannot_be_reconfigured(self):
+        client = TelegramClient(self.BOT_TOKEN)
+        client.configure_executor(ExecutionPolicy.THREAD, max_workers=1)
+        release = threading.Event()
+
+        def message_handler(c, msg) -> None:
+            release.wait(timeout=5)
+
+        await client._executors[ExecutionPolicy.THREAD].submit(client, message_handler, None)
+        with pytest.raises(ClientError):
+            client.configure_executor(ExecutionPolicy.THREAD, max_workers=2)
+
+        release.set()
+        await client._executors[ExecutionPolicy.THREAD].join()
+        client.configure_executor(ExecutionPolicy.THREAD, max_workers=2)
+        assert client._executors[ExecutionPolicy.THREAD].max_workers == 2
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from py_gram import objects
+
+
+class TestMessage:
+
+    @classmethod
+    def _create_message(cls, text: str, entities) -> objects.Message:
+        user = objects.User(id=1, is_bot=False, first_name='John')
+        chat = objects.Chat(id=1965, chat_type=objects.ChatType.PRIVATE)
+        return objects.Message.from_dict({
+            'message_id': 506,
+            'date': int(datetime.utcnow().timestamp()),
+            'from': {'id': user.id, 'is_bot': user.is_bot, 'first_name': user.first_name},
+            'chat': {'id': chat.id, 'type': chat.chat_type.value},
+            'text': text,
+            'entities': [{'type': entity_type, 'offset': offset, 'length': length}
+                         for entity_type, offset, length in entities],
+        })
+
+    def test_entity_texts_of_ascii_text(self):
+        message = self._create_message('/start@SuperBot hi @john', [
+            ('bot_command', 0, 15),
+            ('mention', 19, 5),
+        ])
+
+        assert message.get_entity_texts(objects.MessageEntityType.BOT_COMMAND) == ['/start@SuperBot']
+        assert message.get_entity_texts(objects.MessageEntityType.MENTION) == ['@john']
+        assert message.get_entity_texts(objects.MessageEntityType.URL) == []
+
+    def test_entity_texts_after_astral_characters(self):
+        # each emoji is a single code point but two UTF-16 code units
+        text = '\U0001F600\U0001F680 /help #fun https://example.com \U0001F44D @john'
+        message = self._create_message(text, [
+            ('bot_command', 5, 5),
+            ('hashtag', 11, 4),
+            ('url', 16, 19),
+            ('mention', 39, 5),
+        ])
+
+        assert message.entity_texts == {
+            objects.MessageEntityType.BOT_COMMAND: ['/help'],
+            objects.MessageEntityType.HASHTAG: ['#fun'],
+            objects.MessageEntityType.URL: ['https://example.com'],
+            objects.MessageEntityType.MENTION: ['@john'],
+        }
+
+    def test_entity_texts_are_cached(self):
+        message = self._create_message('/start', [('bot_command', 0, 6)])
+
+        assert message.entity_texts is message.entity_texts
+
+    def test_entity_texts_without_entities(self):
+        message = self._create_message('hello', [])
+
+        assert message.entity_texts == {}
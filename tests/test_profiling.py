@@ -0,0 +1,140 @@
+from datetime import datetime
+import json
+import threading
+import time
+
+import pytest
+
+from py_gram import objects
+from py_gram import CallbackSink
+from py_gram import ExecutionPolicy
+from py_gram import FileSink
+from py_gram import Profiler
+from py_gram import TelegramClient
+
+
+async def slow_handler(c: TelegramClient, msg: objects.Message) -> None:
+    time.sleep(0.05)
+
+
+def slow_sync_handler(c: TelegramClient, msg: objects.Message) -> None:
+    time.sleep(0.05)
+
+
+async def fast_handler(c: TelegramClient, msg: objects.Message) -> None:
+    pass
+
+
+class TestProfiler:
+    BOT_TOKEN = 'test-token'
+    CHAT_ID = 1965
+
+    @classmethod
+    def _create_update(cls, update_id: int = 88) -> objects.Update:
+        user = objects.User(id=1, is_bot=False, first_name='John')
+        chat = objects.Chat(id=cls.CHAT_ID, chat_type=objects.ChatType.PRIVATE)
+        message = objects.Message(message_id=506, from_user=user, date=int(datetime.utcnow().timestamp()), chat=chat,
+                                  text='hello')
+        return objects.Update(update_id=update_id, message=message)
+
+    @pytest.mark.asyncio
+    async def test_spans_of_update_and_handlers(self):
+        records = []
+        profiler = Profiler(CallbackSink(records.append))
+        client = TelegramClient(self.BOT_TOKEN, profiler=profiler)
+        client.register_message_handler(fast_handler)
+
+        await client._receive_update(self._create_update())
+        profiler.close()
+
+        assert [(record.name, record.handler) for record in records] == [
+            ('handler', fast_handler.__qualname__),
+            ('receive_update', None),
+        ]
+        assert all(record.update_id == 88 and record.chat_id == self.CHAT_ID for record in records)
+        assert not any(record.slow for record in records)
+
+    @pytest.mark.asyncio
+    async def test_slow_handler_is_sampled(self):
+        records = []
+        profiler = Profiler(CallbackSink(records.append), slow_threshold=0.01, sample_interval=0.002,
+                            slow_only=True)
+        client = TelegramClient(self.BOT_TOKEN, profiler=profiler)
+        client.register_message_handler(fast_handler)
+        client.register_message_handler(slow_handler)
+
+        await client._receive_update(self._create_update())
+        profiler.close()
+
+        handler_records = [record for record in records if record.name == 'handler']
+        assert len(handler_records) == 1
+        assert handler_records[0].handler == slow_handler.__qualname__
+        assert handler_records[0].slow
+        assert handler_records[0].samples
+        assert any('slow_handler' in line for line in handler_records[0].samples[0])
+
+    @pytest.mark.asyncio
+    async def test_slow_thread_pool_handler_is_sampled_in_its_thread(self):
+        records = []
+        profiler = Profiler(CallbackSink(records.append), slow_threshold=0.01, sample_interval=0.002)
+        client = TelegramClient(self.BOT_TOKEN, profiler=profiler)
+        client.register_message_handler(slow_sync_handler, policy=ExecutionPolicy.THREAD)
+
+        await client._receive_update(self._create_update())
+        await client._executors[ExecutionPolicy.THREAD].join()
+        client._executors[ExecutionPolicy.THREAD].shutdown()
+        profiler.close()
+
+        handler_records = [record for record in records if record.name == 'handler']
+        assert len(handler_records) == 1
+        assert handler_records[0].handler == slow_sync_handler.__qualname__
+        assert handler_records[0].update_id == 88
+        assert handler_records[0].chat_id == self.CHAT_ID
+        assert handler_records[0].slow
+        assert handler_records[0].samples
+        assert any('slow_sync_handler' in line for line in handler_records[0].samples[0])
+
+    def test_spans_starting_in_several_threads_share_one_sampler(self):
+        profiler = Profiler(CallbackSink(lambda record: None), slow_threshold=1)
+        barrier = threading.Barrier(8)
+
+        def start_span() -> None:
+            barrier.wait()
+            with profiler.update_span(self._create_update()):
+                pass
+
+        workers = [threading.Thread(target=start_span) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert [thread.name for thread in threading.enumerate()].count('py_gram-profiler') == 1
+        profiler.close()
+        assert 'py_gram-profiler' not in [thread.name for thread in threading.enumerate()]
+
+    @pytest.mark.asyncio
+    async def test_unsampled_updates_are_not_traced(self):
+        records = []
+        profiler = Profiler(CallbackSink(records.append), sample_rate=0)
+        client = TelegramClient(self.BOT_TOKEN, profiler=profiler)
+        client.register_message_handler(fast_handler)
+
+        await client._receive_update(self._create_update())
+        profiler.close()
+
+        assert records == []
+
+    @pytest.mark.asyncio
+    async def test_file_sink(self, tmp_path):
+        path = tmp_path / 'profile.jsonl'
+        profiler = Profiler(FileSink(str(path)))
+        client = TelegramClient(self.BOT_TOKEN, profiler=profiler)
+        client.register_message_handler(fast_handler)
+
+        await client._receive_update(self._create_update())
+        profiler.close()
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line['name'] for line in lines] == ['handler', 'receive_update']
+        assert lines[1]['update_id'] == 88
@@ -0,0 +1,101 @@
+from datetime import datetime
+import asyncio
+
+import pytest
+
+from py_gram import objects
+from py_gram import PriorityScheduler
+from py_gram import SheddingPolicy
+from py_gram import UpdatePriority
+
+
+class TestPriorityScheduler:
+
+    @classmethod
+    def _create_update(cls, update_id: int, text: str = 'hello', is_command: bool = False,
+                       is_callback_query: bool = False) -> objects.Update:
+        user = objects.User(id=1, is_bot=False, first_name='John')
+        chat = objects.Chat(id=1965, chat_type=objects.ChatType.PRIVATE)
+        entities = [objects.MessageEntity(objects.MessageEntityType.BOT_COMMAND, 0, len(text))] if is_command else None
+        message = objects.Message(message_id=update_id, from_user=user, date=int(datetime.utcnow().timestamp()),
+                                  chat=chat, text=text, entities=entities)
+        callback_query = objects.CallbackQuery(id=str(update_id), from_user=user, message=message) \
+            if is_callback_query else None
+        return objects.Update(update_id=update_id, message=message, callback_query=callback_query)
+
+    def test_classify(self):
+        assert PriorityScheduler.classify(self._create_update(1, is_callback_query=True)) == \
+            UpdatePriority.CALLBACK_QUERY
+        assert PriorityScheduler.classify(self._create_update(2, '/start', is_command=True)) == UpdatePriority.COMMAND
+        assert PriorityScheduler.classify(self._create_update(3)) == UpdatePriority.MESSAGE
+
+    @pytest.mark.asyncio
+    async def test_get_returns_updates_by_priority(self):
+        scheduler = PriorityScheduler()
+        await scheduler.put(self._create_update(1))
+        await scheduler.put(self._create_update(2, '/start', is_command=True))
+        await scheduler.put(self._create_update(3))
+        await scheduler.put(self._create_update(4, is_callback_query=True))
+
+        update_ids = [(await scheduler.get()).update_id for _ in range(4)]
+
+        assert update_ids == [4, 2, 1, 3]
+        assert scheduler.get_nowait() is None
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_sheddable_updates(self):
+        shed = []
+        scheduler = PriorityScheduler(max_queue_sizes={UpdatePriority.MESSAGE: 1}, on_shed=shed.append)
+        await scheduler.put(self._create_update(1))
+        await scheduler.put(self._create_update(2))
+
+        assert len(scheduler) == 1
+        assert scheduler.dropped_count == 1
+        assert [update.update_id for update in shed] == [2]
+
+    @pytest.mark.asyncio
+    async def test_full_queue_waits_for_room_for_callback_queries(self):
+        scheduler = PriorityScheduler(max_queue_sizes={UpdatePriority.CALLBACK_QUERY: 1})
+        await scheduler.put(self._create_update(1, is_callback_query=True))
+        put = asyncio.ensure_future(scheduler.put(self._create_update(2, is_callback_query=True)))
+        await asyncio.sleep(0.01)
+        assert not put.done()
+
+        assert (await scheduler.get()).update_id == 1
+        await put
+        assert (await scheduler.get()).update_id == 2
+        assert scheduler.dropped_count == 0
+
+    @pytest.mark.asyncio
+    async def test_wait_for_room_waits_below_max_pending(self):
+        scheduler = PriorityScheduler(max_pending=2)
+        await scheduler.put(self._create_update(1))
+        await scheduler.wait_for_room()
+        await scheduler.put(self._create_update(2, is_callback_query=True))
+        waiting = asyncio.ensure_future(scheduler.wait_for_room())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        assert (await scheduler.get()).update_id == 2
+        await asyncio.wait_for(waiting, timeout=1)
+
+    @pytest.mark.asyncio
+    async def test_lagging_updates_are_deferred(self):
+        scheduler = PriorityScheduler(lag_threshold=0.01, shedding_policy=SheddingPolicy.DEFER)
+        await scheduler.put(self._create_update(1))
+        await asyncio.sleep(0.02)
+        await scheduler.put(self._create_update(2))
+
+        assert (await scheduler.get()).update_id == 2
+        assert scheduler.deferred_count == 1
+        assert (await scheduler.get()).update_id == 1
+        assert scheduler.dropped_count == 0
+
+    @pytest.mark.asyncio
+    async def test_lagging_updates_are_dropped(self):
+        scheduler = PriorityScheduler(lag_threshold=0.01)
+        await scheduler.put(self._create_update(1))
+        await asyncio.sleep(0.02)
+
+        assert scheduler.get_nowait() is None
+        assert scheduler.dropped_count == 1
@@ -0,0 +1,27 @@
+import json
+import os
+import subprocess
+import sys
+
+STARTUP_BENCHMARK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks',
+                                 'startup.py')
+
+
+class TestStartup:
+    # generous bounds, meant to catch regressions such as an eager import of a heavy dependency, not to time precisely
+    MAX_IMPORT_PACKAGE = 0.05
+    MAX_FIRST_REQUEST = 2.0
+
+    @classmethod
+    def _run_benchmark(cls) -> dict:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.run([sys.executable, STARTUP_BENCHMARK], env=env, check=True, capture_output=True,
+                                timeout=60).stdout
+        return json.loads(output)
+
+    def test_cold_start(self):
+        timings = self._run_benchmark()
+
+        assert timings['loaded_by_package_import'] == []
+        assert timings['import_package'] < self.MAX_IMPORT_PACKAGE
+        assert timings['first_request'] < self.MAX_FIRST_REQUEST
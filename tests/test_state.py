@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from py_gram import StateNotLoadedError
+from py_gram import StateStore
+
+
+class TestStateStore:
+    CHAT_ID = 1965
+    USER_ID = 1
+
+    @pytest.fixture
+    def store_path(self, tmp_path) -> str:
+        return str(tmp_path / 'state.db')
+
+    @pytest.mark.asyncio
+    async def test_get_returns_empty_state(self, store_path):
+        store = StateStore(store_path)
+
+        with pytest.raises(StateNotLoadedError):
+            store.get(self.CHAT_ID, self.USER_ID)
+        assert await store.load(self.CHAT_ID, self.USER_ID) == {}
+        assert store.get(self.CHAT_ID, self.USER_ID) == {}
+        assert store.dirty_count == 0
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_flush_persists_dirty_entries(self, store_path):
+        store = StateStore(store_path)
+        store.set(self.CHAT_ID, self.USER_ID, {'step': 'name'})
+        store.set(self.CHAT_ID, 2, {'step': 'age'})
+        assert store.dirty_count == 2
+
+        await store.flush()
+        store.close()
+
+        assert store.dirty_count == 0
+        reopened = StateStore(store_path)
+        assert await reopened.load(self.CHAT_ID, self.USER_ID) == {'step': 'name'}
+        assert await reopened.load(self.CHAT_ID, 2) == {'step': 'age'}
+        reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_evicted_dirty_entry_is_not_lost(self, store_path):
+        store = StateStore(store_path, capacity=1)
+        store.set(self.CHAT_ID, self.USER_ID, {'step': 'name'})
+        store.set(self.CHAT_ID, 2, {'step': 'age'})
+
+        assert len(store) == 1
+        assert store.get(self.CHAT_ID, self.USER_ID) == {'step': 'name'}
+
+        await store.flush()
+        store.close()
+        reopened = StateStore(store_path)
+        assert await reopened.load(self.CHAT_ID, 2) == {'step': 'age'}
+        reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_delete(self, store_path):
+        store = StateStore(store_path)
+        store.set(self.CHAT_ID, self.USER_ID, {'step': 'name'})
+        await store.flush()
+
+        store.delete(self.CHAT_ID, self.USER_ID)
+        await store.flush()
+
+        assert await store.load(self.CHAT_ID, self.USER_ID) == {}
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_write_behind_flushes_full_batch(self, store_path):
+        store = StateStore(store_path, flush_interval=60, batch_size=2)
+        await store.start()
+        store.set(self.CHAT_ID, self.USER_ID, {'step': 'name'})
+        store.set(self.CHAT_ID, 2, {'step': 'age'})
+
+        for _ in range(100):
+            if not store.dirty_count:
+                break
+            await asyncio.sleep(0.01)
+
+        assert store.dirty_count == 0
+        await store.stop()
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_delete_while_loading(self, store_path):
+        store = StateStore(store_path)
+        store.set(self.CHAT_ID, self.USER_ID, {'step': 'name'})
+        await store.flush()
+        store._cache.clear()
+        deleted = threading.Event()
+        read = store._read_row
+
+        def read_before_delete(key):
+            state = read(key)
+            deleted.wait(timeout=5)
+            return state
+
+        store._read_row = read_before_delete
+        loading = asyncio.ensure_future(store.load(self.CHAT_ID, self.USER_ID))
+        await asyncio.sleep(0.01)
+        store.delete(self.CHAT_ID, self.USER_ID)
+        deleted.set()
+        await loading
+        store._read_row = read
+
+        assert store.get(self.CHAT_ID, self.USER_ID) == {}
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_stop_right_after_a_flush_is_requested(self, store_path):
+        store_flush_interval = 1
+        store = StateStore(store_path, flush_interval=store_flush_interval, batch_size=1)
+        await store.start()
+        await asyncio.sleep(0)
+        store.set(self.CHAT_ID, self.USER_ID, {'step': 'name'})
+
+        started = time.monotonic()
+        await asyncio.wait_for(store.stop(), timeout=store_flush_interval)
+
+        assert time.monotonic() - started < store_flush_interval / 2
+        assert store.dirty_count == 0
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_unserializable_state_does_not_hold_up_the_batch(self, store_path):
+        store = StateStore(store_path, flush_interval=60, batch_size=2)
+        await store.start()
+        store.set(self.CHAT_ID, self.USER_ID, {'steps': {'name'}})
+        store.set(self.CHAT_ID, 2, {'step': 'age'})
+
+        for _ in range(100):
+            if not store.dirty_count:
+                break
+            await asyncio.sleep(0.01)
+
+        assert store.dirty_count == 0
+        store.set(self.CHAT_ID, 3, {'step': 'done'})
+        await asyncio.wait_for(store.stop(), timeout=1)
+        store.close()
+
+        reopened = StateStore(store_path)
+        assert await reopened.load(self.CHAT_ID, 2) == {'step': 'age'}
+        assert await reopened.load(self.CHAT_ID, 3) == {'step': 'done'}
+        assert await reopened.load(self.CHAT_ID, self.USER_ID) == {}
+        reopened.close()
@@ -12,6 +12,8 @@ import pytest
 
 from py_gram import objects
 from py_gram import ClientError
+from py_gram import PriorityScheduler
+from py_gram import StateStore
 from py_gram import TelegramClient
 
 
@@ -129,6 +131,36 @@ class TestTelegramClient:
         assert received_update.message.chat.id == update.message.chat.id
         assert received_update.message.chat.chat_type == update.message.chat.chat_type
 
+    @pytest.mark.asyncio
+    async def test_updates(self, client, httpx_mock: HTTPXMock):
+        response, update = self._create_response_for_update()
+        next_response, _ = self._create_response_for_update()
+        next_response['result'][0]['update_id'] = update.update_id + 1
+        httpx_mock.add_response(url=f'{self.BASE_URL}/getUpdates?timeout=30', json=response)
+        httpx_mock.add_response(url=f'{self.BASE_URL}/getUpdates?offset={update.update_id + 1}&timeout=30',
+                                json=next_response)
+
+        received = []
+        async for received_update in client.updates():
+            received.append(received_update)
+            if len(received) == 2:
+                break
+
+        assert [received_update.update_id for received_update in received] == [update.update_id,
+                                                                                update.update_id + 1]
+        assert received[0].message.message_id == update.message.message_id
+
+    @pytest.mark.asyncio
+    async def test_updates_in_raw_batches(self, client, httpx_mock: HTTPXMock):
+        response, update = self._create_response_for_update()
+        url = f'{self.BASE_URL}/getUpdates?timeout=30&limit=10'
+        httpx_mock.add_response(url=url, json=response)
+
+        async for batch in client.updates(batch_size=10, raw=True):
+            break
+
+        assert batch == response['result']
+
     def test_start_listening_for_updates_for_message(self, client, httpx_mock: HTTPXMock):
         response, update = self._create_response_for_update()
         url = f'{self.BASE_URL}/getUpdates'
@@ -194,6 +226,81 @@ class TestTelegramClient:
         assert handled_callback.message.message_id == update.callback_query.message.message_id
         assert handled_callback.from_user.id == update.callback_query.from_user.id
 
+    def test_start_listening_for_updates_with_scheduler(self, httpx_mock: HTTPXMock):
+        response, update = self._create_response_for_update()
+        command_response, _ = self._create_response_for_update('/my_command')
+        response['result'].append(dict(command_response['result'][0], update_id=update.update_id + 1))
+        url = f'{self.BASE_URL}/getUpdates'
+        httpx_mock.add_response(url=url, json=response)
+
+        client = TelegramClient(self.BOT_TOKEN, scheduler=PriorityScheduler())
+        handled = []
+
+        async def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            handled.append('message')
+
+        async def command_handler(c: TelegramClient, cmd: str, msg: objects.Message) -> None:
+            handled.append(cmd)
+
+        client.register_message_handler(message_handler)
+        client.register_command_handler('/my_command', command_handler)
+        try:
+            client.start_listening_for_updates()
+        except httpx.TimeoutException:
+            pass
+
+        assert handled == ['/my_command', 'message']
+
+    @pytest.mark.asyncio
+    async def test_cancelled_scheduled_worker_dispatches_pending_updates(self, httpx_mock: HTTPXMock):
+        response, update = self._create_response_for_update()
+        command_response, _ = self._create_response_for_update('/my_command')
+        response['result'].append(dict(command_response['result'][0], update_id=update.update_id + 1))
+        httpx_mock.add_response(url=f'{self.BASE_URL}/getUpdates', json=response)
+
+        client = TelegramClient(self.BOT_TOKEN, scheduler=PriorityScheduler())
+        handled = []
+
+        async def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            handled.append('message')
+
+        async def command_handler(c: TelegramClient, cmd: str, msg: objects.Message) -> None:
+            handled.append(cmd)
+            worker.cancel()
+            await asyncio.sleep(0)
+
+        client.register_message_handler(message_handler)
+        client.register_command_handler('/my_command', command_handler)
+        worker = asyncio.ensure_future(client._dispatch_scheduled_updates())
+        with pytest.raises(asyncio.CancelledError):
+            await worker
+
+        assert handled == ['/my_command', 'message']
+
+    def test_start_listening_for_updates_with_state(self, httpx_mock: HTTPXMock, tmp_path):
+        response, update = self._create_response_for_update()
+        url = f'{self.BASE_URL}/getUpdates'
+        httpx_mock.add_response(url=url, json=response)
+
+        store_path = str(tmp_path / 'state.db')
+        client = TelegramClient(self.BOT_TOKEN, state_store=StateStore(store_path))
+
+        async def message_handler(c: TelegramClient, msg: objects.Message) -> None:
+            state = c.get_state(msg.chat.id, msg.from_user.id)
+            state['count'] = state.get('count', 0) + 1
+            c.set_state(msg.chat.id, msg.from_user.id, state)
+
+        client.register_message_handler(message_handler)
+        try:
+            client.start_listening_for_updates()
+        except httpx.TimeoutException:
+            pass
+        client.state_store.close()
+
+        store = StateStore(store_path)
+        assert asyncio.run(store.load(update.message.chat.id, update.message.from_user.id)) == {'count': 1}
+        store.close()
+
     @pytest.mark.asyncio
     async def test_send_message(self, client, httpx_mock: HTTPXMock):
         message_id = 566